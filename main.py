@@ -5,9 +5,18 @@ This module initializes the FastAPI application, sets up routes,
 configures the database, and provides dependency injection for database access.
 """
 
+import gzip
+import hashlib
+from abc import ABC, abstractmethod
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import Optional, List
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, create_engine
 from sqlalchemy.ext.declarative import declarative_base
@@ -17,11 +26,33 @@ from jose import JWTError, jwt
 # pylint: disable=no-name-in-module
 from pydantic import BaseModel
 
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
 # Constants
 SECRET_KEY = "xjkqsbxkhjqbcjckxcjsqbhkjchqshkbcjqbjckjbkjnkjbx,whkbw,nxbxvhn"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Response compression
+COMPRESSION_MINIMUM_SIZE = 500
+COMPRESSION_LEVELS = {"br": 4, "zstd": 3, "gzip": 6}
+COMPRESSION_CACHE_SIZE = 128
+COMPRESSIBLE_MEDIA_TYPES = ("application/json", "text/")
+
+# Rate limiting for the password endpoints (burst size, tokens per second)
+AUTH_IP_LIMIT = (50, 1.0)
+AUTH_USERNAME_LIMIT = (10, 0.1)
+MAX_CONCURRENT_PASSWORD_OPERATIONS = 4
+PASSWORD_SLOT_TIMEOUT = 0.5
+
 Base = declarative_base()
 
 # Password hashing
@@ -46,6 +77,112 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+# Rate limiting
+class TokenBucketStore(ABC):
+    """
+    Interface for token-bucket storage.
+    Implement consume() against a shared backend (e.g. Redis) to share
+    the limits between workers.
+    """
+
+    @abstractmethod
+    def consume(self, key: str, capacity: int, rate: float) -> float:
+        """
+        Take a token from the bucket identified by key.
+        Args:
+            key (str): The bucket key.
+            capacity (int): The bucket size.
+            rate (float): The refill rate in tokens per second.
+        Returns:
+            float: 0 when a token was taken, otherwise the seconds to wait.
+        """
+
+
+class InMemoryTokenBucketStore(TokenBucketStore):
+    """
+    Token-bucket storage local to the current process.
+    At most max_keys buckets are kept, see _evict().
+    """
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key: str, capacity: int, rate: float) -> float:
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated, _, _ = self.buckets.pop(key, (capacity, now, capacity, rate))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            retry_after = (1 - tokens) / rate if tokens < 1 else 0.0
+            self.buckets[key] = (tokens if retry_after else tokens - 1, now, capacity, rate)
+            if len(self.buckets) > self.max_keys:
+                self._evict(now)
+            return retry_after
+
+    def _evict(self, now: float):
+        """
+        Make room for new buckets.
+        Buckets that have refilled completely are dropped first, since they
+        would come back full anyway. The least recently used buckets are only
+        evicted when that does not free a tenth of the store, which also keeps
+        the sweep to once per max_keys / 10 new keys.
+        """
+        self.buckets = OrderedDict(
+            (key, bucket) for key, bucket in self.buckets.items()
+            if bucket[0] + (now - bucket[1]) * bucket[3] < bucket[2])
+        while len(self.buckets) > self.max_keys * 0.9:
+            self.buckets.popitem(last=False)
+
+
+rate_limit_store: TokenBucketStore = InMemoryTokenBucketStore()
+password_semaphore = threading.BoundedSemaphore(MAX_CONCURRENT_PASSWORD_OPERATIONS)
+
+
+def too_many_requests(retry_after: float):
+    """
+    Build the 429 error returned when load is shed.
+    """
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many requests",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def enforce_auth_rate_limits(client_ip: str, username: str):
+    """
+    Apply the per-IP and per-username limits of the password endpoints.
+    The username bucket is only charged once the IP bucket let the call through.
+    Args:
+        client_ip (str): The address of the client.
+        username (str): The username sent by the client.
+    Raises:
+        HTTPException: 429 when either bucket is empty.
+    """
+    retry_after = rate_limit_store.consume(f"auth:ip:{client_ip}", *AUTH_IP_LIMIT)
+    if not retry_after:
+        retry_after = rate_limit_store.consume(f"auth:user:{username.lower()}",
+                                               *AUTH_USERNAME_LIMIT)
+    if retry_after:
+        raise too_many_requests(retry_after)
+
+
+@contextmanager
+def password_slot():
+    """
+    Cap the number of password hashes computed concurrently.
+    Raises:
+        HTTPException: 429 when no slot frees up in time.
+    """
+    if not password_semaphore.acquire(timeout=PASSWORD_SLOT_TIMEOUT):
+        raise too_many_requests(1)
+    try:
+        yield
+    finally:
+        password_semaphore.release()
+
+
 # JWT Token utility
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """
@@ -190,12 +327,153 @@ def get_db():
         db.close()
 
 
+def limit_auth_requests(request: Request, user: UserCreate):
+    """
+    Dependency rate limiting the password endpoints.
+    Declared on the route so that it runs before a database session is opened.
+    """
+    enforce_auth_rate_limits(request.client.host if request.client else "", user.username)
+
+
 # FastAPI instance
 app = FastAPI()
 
 
+# Response compression
+# Encodings in order of preference, limited to the codecs installed.
+COMPRESSION_ENCODINGS = [name for name, codec in (("br", brotli),
+                                                  ("zstd", zstandard),
+                                                  ("gzip", gzip))
+                         if codec is not None]
+
+compression_cache = OrderedDict()
+compression_metrics = {
+    "responses": 0,
+    "cache_hits": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+    "cpu_seconds": 0.0,
+}
+compression_lock = threading.Lock()
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Pick the preferred encoding accepted by the client.
+    :param accept_encoding: The raw Accept-Encoding header.
+    :return: The encoding name, or None when nothing suitable is accepted.
+    """
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    wildcard = accepted.get("*", 0.0)
+    best_encoding, best_quality = None, 0.0
+    for encoding in COMPRESSION_ENCODINGS:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best_encoding, best_quality = encoding, quality
+    return best_encoding
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    """
+    Compress the body with the given encoding at its configured level.
+    """
+    level = COMPRESSION_LEVELS[encoding]
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def compress_body(body: bytes, encoding: str, cacheable: bool = False) -> bytes:
+    """
+    Compress a response body and record the compression metrics.
+    Cacheable bodies keep their compressed bytes so that repeated polls
+    of an unchanged payload skip the compression step.
+    :param body: The serialized response body.
+    :param encoding: The negotiated content encoding.
+    :param cacheable: Whether the compressed bytes may be cached.
+    :return: The compressed body.
+    """
+    key = None
+    if cacheable:
+        key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+        with compression_lock:
+            payload = compression_cache.get(key)
+            if payload is not None:
+                compression_cache.move_to_end(key)
+                compression_metrics["responses"] += 1
+                compression_metrics["cache_hits"] += 1
+                compression_metrics["bytes_in"] += len(body)
+                compression_metrics["bytes_out"] += len(payload)
+                return payload
+    started = time.thread_time()
+    payload = _compress(body, encoding)
+    elapsed = time.thread_time() - started
+    with compression_lock:
+        compression_metrics["responses"] += 1
+        compression_metrics["bytes_in"] += len(body)
+        compression_metrics["bytes_out"] += len(payload)
+        compression_metrics["cpu_seconds"] += elapsed
+        if key is not None:
+            compression_cache[key] = payload
+            if len(compression_cache) > COMPRESSION_CACHE_SIZE:
+                compression_cache.popitem(last=False)
+    return payload
+
+
+async def _single_chunk(payload: bytes):
+    """
+    Yield the payload as a single body chunk.
+    """
+    yield payload
+
+
+@app.middleware("http")
+async def compress_response(request: Request, call_next):
+    """
+    Compress responses with the encoding negotiated from Accept-Encoding.
+    Bodies smaller than COMPRESSION_MINIMUM_SIZE are sent as they are.
+    :param request:
+    :param call_next:
+    :return: The (possibly compressed) response
+    """
+    response = await call_next(request)
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    media_type = response.headers.get("content-type", "")
+    # The whole body is buffered before compressing, so only responses with a
+    # known length are handled and streaming responses pass through untouched.
+    if (encoding is None
+            or response.status_code in (204, 304)
+            or "content-encoding" in response.headers
+            or "content-length" not in response.headers
+            or not media_type.startswith(COMPRESSIBLE_MEDIA_TYPES)):
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    response.headers.add_vary_header("Accept-Encoding")
+    if len(body) >= COMPRESSION_MINIMUM_SIZE:
+        body = await run_in_threadpool(compress_body, body, encoding,
+                                       request.method == "GET")
+        response.headers["Content-Encoding"] = encoding
+        response.headers["Content-Length"] = str(len(body))
+    response.body_iterator = _single_chunk(body)
+    return response
+
+
 # Routes
-@app.post("/register", response_model=Token)
+@app.post("/register", response_model=Token, dependencies=[Depends(limit_auth_requests)])
 def register(user: UserCreate, db: Session = Depends(get_db)):
     """
     The registration method for registering a new user.
@@ -203,7 +481,8 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
     :param db:
     :return:JWT-Token
     """
-    hashed_password = get_password_hash(user.password)
+    with password_slot():
+        hashed_password = get_password_hash(user.password)
     db_user = User(username=user.username, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
@@ -212,7 +491,7 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-@app.post("/login", response_model=Token)
+@app.post("/login", response_model=Token, dependencies=[Depends(limit_auth_requests)])
 def login(user: UserCreate, db: Session = Depends(get_db)):
     """
     The login method for login.
@@ -223,7 +502,12 @@ def login(user: UserCreate, db: Session = Depends(get_db)):
     db_user = (db.query(User)
                .filter(User.username == user.username)
                .first())
-    if not db_user or not verify_password(user.password, db_user.hashed_password):
+    if not db_user:
+        raise HTTPException(status_code=400,
+                            detail="Invalid username or password")
+    with password_slot():
+        valid = verify_password(user.password, db_user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=400,
                             detail="Invalid username or password")
     access_token = create_access_token(data={"sub": db_user.username})
@@ -365,6 +649,19 @@ def mark_todo_as_complete(todo_id: int, db: Session = Depends(get_db),
     return db_todo
 
 
+@app.get("/metrics/compression", dependencies=[Depends(get_current_user)])
+def get_compression_metrics():
+    """
+    The metrics method for reporting response compression.
+    :return: compression counters, ratio and CPU time
+    """
+    with compression_lock:
+        metrics = dict(compression_metrics)
+    metrics["ratio"] = (metrics["bytes_in"] / metrics["bytes_out"]
+                        if metrics["bytes_out"] else 0.0)
+    return metrics
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -6,9 +6,14 @@ functionalities of the FastAPI application, ensuring their correctness
 in isolation.
 """
 
+import threading
+import types
 import uuid
 import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 from fastapi.testclient import TestClient
+import main
 from main import app, Base, engine, SessionLocal
 
 
@@ -23,6 +28,17 @@ def client():
         yield c
 
 
+@pytest.fixture(autouse=True)
+def rate_limit_store(monkeypatch):
+    """
+    Give every test its own rate limit buckets
+    :return:
+    """
+    store = main.InMemoryTokenBucketStore()
+    monkeypatch.setattr(main, "rate_limit_store", store)
+    return store
+
+
 @pytest.fixture(scope="function")
 def db_session():
     """
@@ -213,3 +229,194 @@ def test_mark_todo_complete(client,  unique_username):# pylint: disable=redefine
                             headers={"Authorization": f"Bearer {token}"})
     assert response.status_code == 200
     assert response.json()["completed"] is True
+
+
+# Test that large todo lists are compressed
+def test_get_todos_compressed(client,  unique_username):# pylint: disable=redefined-outer-name
+    """
+    Compressing a large todo list unit test .
+    :param client:
+    :param unique_username:
+    :return:
+    """
+    client.post("/register",
+                json={"username": unique_username, "password": "password"})
+    login_response = client.post("/login",
+                                 json={"username": unique_username, "password": "password"})
+    token = login_response.json()["access_token"]
+
+    # Create a todo large enough to pass the compression threshold
+    client.post("/todos",
+                json={"task": "Test Todo " * 100, "completed": False},
+                headers={"Authorization": f"Bearer {token}"})
+
+    # Poll the todos twice, the second response is served from the cache
+    for _ in range(2):
+        response = client.get("/todos",
+                              headers={"Authorization": f"Bearer {token}",
+                                       "Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["vary"]
+        assert response.json()[0]["task"] == "Test Todo " * 100
+
+    response = client.get("/metrics/compression")
+    assert response.status_code == 401
+    metrics = client.get("/metrics/compression",
+                         headers={"Authorization": f"Bearer {token}"}).json()
+    assert metrics["cache_hits"] >= 1
+    assert metrics["ratio"] > 1
+
+
+# Test that small responses are not compressed
+def test_small_response_not_compressed(client,  unique_username):# pylint: disable=redefined-outer-name
+    """
+    Skipping compression below the threshold unit test .
+    :param client:
+    :param unique_username:
+    :return:
+    """
+    response = client.post("/register",
+                           json={"username": unique_username, "password": "password"},
+                           headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert "access_token" in response.json()
+
+
+# Test the per-username rate limit on login
+def test_login_rate_limited(client, unique_username, monkeypatch):# pylint: disable=redefined-outer-name
+    """
+    Rate limiting login attempts unit test .
+    :param client:
+    :param unique_username:
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr(main, "AUTH_USERNAME_LIMIT", (2, 0.01))
+    client.post("/register", json={"username": unique_username, "password": "password"})
+
+    response = client.post("/login", json={"username": unique_username, "password": "password"})
+    assert response.status_code == 200
+    response = client.post("/login", json={"username": unique_username, "password": "password"})
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+
+
+# Test the per-IP rate limit on register
+def test_register_rate_limited_per_ip(client, monkeypatch):# pylint: disable=redefined-outer-name
+    """
+    Rate limiting registrations from one address unit test .
+    :param client:
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr(main, "AUTH_IP_LIMIT", (1, 0.01))
+
+    response = client.post("/register",
+                           json={"username": f"testuser_{uuid.uuid4()}", "password": "password"})
+    assert response.status_code == 200
+    response = client.post("/register",
+                           json={"username": f"testuser_{uuid.uuid4()}", "password": "password"})
+    assert response.status_code == 429
+    assert "retry-after" in response.headers
+
+
+# Test the concurrency cap on password operations
+def test_password_operations_shed(client, unique_username, monkeypatch):# pylint: disable=redefined-outer-name
+    """
+    Shedding password operations when every slot is busy unit test .
+    :param client:
+    :param unique_username:
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr(main, "password_semaphore", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(main, "PASSWORD_SLOT_TIMEOUT", 0)
+    with main.password_slot():
+        response = client.post("/register",
+                                json={"username": unique_username, "password": "password"})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
+
+
+# Test that the bucket store never grows past its limit
+def test_token_bucket_store_bounded():
+    """
+    Evicting least recently used buckets unit test .
+    :return:
+    """
+    store = main.InMemoryTokenBucketStore(max_keys=10)
+    for i in range(100):
+        assert store.consume(f"key_{i}", 1, 0.01) == 0
+    assert len(store.buckets) == 10
+    assert store.consume("key_99", 1, 0.01) > 0
+
+
+# Test that a drained bucket is not evicted in favour of refilled ones
+def test_token_bucket_store_keeps_drained_buckets(monkeypatch):
+    """
+    Evicting refilled buckets first unit test .
+    :param monkeypatch:
+    :return:
+    """
+    clock = [0.0]
+    monkeypatch.setattr(main, "time", types.SimpleNamespace(monotonic=lambda: clock[0]))
+    store = main.InMemoryTokenBucketStore(max_keys=10)
+    assert store.consume("victim", 1, 0.001) == 0
+    for i in range(100):
+        clock[0] += 1
+        assert store.consume(f"key_{i}", 1, 10) == 0
+    assert "victim" in store.buckets
+    assert store.consume("victim", 1, 0.001) > 0
+
+
+# Test that non-JSON bodies are rejected before rate limiting
+def test_login_non_json_body(client):# pylint: disable=redefined-outer-name
+    """
+    Rejecting a form encoded login unit test .
+    :param client:
+    :return:
+    """
+    response = client.post("/login", data={"username": "a", "password": "b"})
+    assert response.status_code == 422
+    response = client.post("/login", content="not json",
+                           headers={"Content-Type": "text/plain"})
+    assert response.status_code == 422
+
+
+# Test that unknown users do not take a password slot
+def test_login_unknown_user_no_slot(client, unique_username, monkeypatch):# pylint: disable=redefined-outer-name
+    """
+    Failing an unknown user login without a password slot unit test .
+    :param client:
+    :param unique_username:
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr(main, "password_semaphore", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(main, "PASSWORD_SLOT_TIMEOUT", 0)
+    with main.password_slot():
+        response = client.post("/login",
+                               json={"username": unique_username, "password": "password"})
+    assert response.status_code == 400
+
+
+# Test that streaming responses are passed through uncompressed
+def test_streaming_response_not_compressed():
+    """
+    Leaving streaming responses untouched unit test .
+    :return:
+    """
+    stream_app = FastAPI()
+    stream_app.middleware("http")(main.compress_response)
+
+    @stream_app.get("/events")
+    def events():
+        return StreamingResponse(iter([b"data: x" * 200]), media_type="text/event-stream")
+
+    with TestClient(stream_app) as stream_client:
+        response = stream_client.get("/events", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert response.text == "data: x" * 200